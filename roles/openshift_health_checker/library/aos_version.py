@@ -18,7 +18,14 @@ not work out right. Note that if openshift_release is not specified in
 the inventory, the version comparison checks just pass.
 """
 
-from ansible.module_utils.basic import AnsibleModule
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from collections import namedtuple
+
 # NOTE: because of the dependency on yum (Python 2-only), this module does not
 # work under Python 3. But since we run unit tests against both Python 2 and
 # Python 3, we use six for cross compatibility in this module alone:
@@ -36,6 +43,45 @@ try:
 except ImportError as err:
     DNF_IMPORT_EXCEPTION = err
 
+# lightweight stand-in for package objects, when all we have are names and versions
+Package = namedtuple('Package', ['name', 'version'])
+
+# results are cached across runs on the same host, keyed by the state of the
+# package manager and repo configuration, repo metadata and rpm database
+# (Berkeley DB on older hosts, sqlite on newer ones) that they came from.
+CACHE_FILE = '/var/tmp/aos_version_cache.json'
+CACHE_KEY_PATHS = dict(
+    yum=[
+        '/etc/yum.conf',
+        '/etc/yum.repos.d',
+        '/etc/yum.repos.d/*.repo',
+        '/var/cache/yum/*/*/*/repomd.xml',
+    ],
+    dnf=[
+        '/etc/dnf/dnf.conf',
+        '/etc/yum.repos.d',
+        '/etc/yum.repos.d/*.repo',
+        '/var/cache/dnf/*/repodata/repomd.xml',
+    ],
+)
+CACHE_KEY_PATHS_COMMON = [
+    '/var/lib/rpm/Packages',
+    '/var/lib/rpm/rpmdb.sqlite',
+    '/usr/lib/sysimage/rpm/rpmdb.sqlite',
+]
+
+# copied for repoquery with excludes cleared, see _retrieve_repoquery_packages
+YUM_CONF = '/etc/yum.conf'
+
+# set to 1 in the environment to skip AnsibleModule setup, see _FastModule
+FAST_STARTUP_ENV = 'AOS_VERSION_FAST_STARTUP'
+
+ARGUMENT_SPEC = dict(
+    package_list=dict(type="list", required=True),
+    package_mgr=dict(type="str", required=True),
+    use_yum_api=dict(type="bool", default=False),
+)
+
 
 class AosVersionException(Exception):
     """Base exception class for package version problems"""
@@ -44,34 +90,105 @@ class AosVersionException(Exception):
         self.problem_pkgs = problem_pkgs
 
 
+class _FastModule(object):
+    """Minimal stand-in for AnsibleModule, for when its setup (importing
+    module_utils, argument validation, logging and cleanup hooks) would
+    cost more than this read-only module itself. Reads the arguments the
+    way AnsibleModule does, and converts them like it does for the few
+    argument types this module uses."""
+
+    # as in ansible.module_utils.parsing.convert_bool
+    BOOLEANS_TRUE = frozenset(('y', 'yes', 'on', '1', 'true', 't', 1, 1.0, True))
+    BOOLEANS_FALSE = frozenset(('n', 'no', 'off', '0', 'false', 'f', 0, 0.0, False))
+
+    def __init__(self, argument_spec):
+        try:
+            args = json.loads(self._read_args())
+            args = args.get('ANSIBLE_MODULE_ARGS', args)
+        except (IOError, OSError, ValueError, AttributeError) as excinfo:
+            self.fail_json(msg="could not read module arguments: {}".format(excinfo))
+
+        self.params = {}
+        for name, spec in argument_spec.items():
+            if name in args:
+                self.params[name] = self._convert(name, args[name], spec.get('type', 'str'))
+            elif spec.get('required'):
+                self.fail_json(msg="missing required arguments: {}".format(name))
+            else:
+                self.params[name] = spec.get('default')
+
+    def _convert(self, name, value, arg_type):
+        """Convert an argument value to the type in its spec, or fail
+        like AnsibleModule does for values that cannot be converted."""
+        if arg_type == 'bool':
+            if isinstance(value, string_types):
+                value = value.lower()
+            # lists and dicts are unhashable, and never booleans anyway
+            if isinstance(value, string_types + (int, float)):
+                if value in self.BOOLEANS_TRUE:
+                    return True
+                if value in self.BOOLEANS_FALSE:
+                    return False
+        elif arg_type == 'list':
+            if isinstance(value, list):
+                return value
+            if isinstance(value, string_types):
+                return value.split(",")
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                return [str(value)]
+        elif arg_type == 'str':
+            # AnsibleModule also converts other values, with a warning
+            return value if isinstance(value, string_types) else str(value)
+        else:
+            raise ValueError("unsupported argument type: {}".format(arg_type))
+        self.fail_json(msg="argument {} is of type {} and we were unable to convert to {}".format(
+            name, type(value), arg_type,
+        ))
+
+    @staticmethod
+    def _read_args():
+        # like ansible.module_utils.basic._load_params: AnsiballZ passes the
+        # arguments on stdin; a file or JSON string as first argument is only
+        # a debugging override.
+        if len(sys.argv) > 1:
+            if os.path.isfile(sys.argv[1]):
+                with open(sys.argv[1], 'rb') as args_file:
+                    return args_file.read().decode('utf-8')
+            return sys.argv[1]
+        return getattr(sys.stdin, 'buffer', sys.stdin).read().decode('utf-8')
+
+    @staticmethod
+    def exit_json(**kwargs):
+        """Report the result and exit, like AnsibleModule.exit_json"""
+        sys.stdout.write(json.dumps(kwargs) + '\n')
+        sys.exit(0)
+
+    @staticmethod
+    def fail_json(**kwargs):
+        """Report a failure and exit, like AnsibleModule.fail_json"""
+        kwargs['failed'] = True
+        sys.stdout.write(json.dumps(kwargs) + '\n')
+        sys.exit(1)
+
+
 def main():
     """Entrypoint for this Ansible module"""
-    module = AnsibleModule(
-        argument_spec=dict(
-            package_list=dict(type="list", required=True),
-            package_mgr=dict(type="str", required=True),
-        ),
-        supports_check_mode=True
-    )
+    if os.environ.get(FAST_STARTUP_ENV) == '1':
+        module = _FastModule(ARGUMENT_SPEC)
+    else:
+        from ansible.module_utils.basic import AnsibleModule
+        module = AnsibleModule(argument_spec=ARGUMENT_SPEC, supports_check_mode=True)
 
     # determine the package manager to use
     package_mgr = module.params['package_mgr']
     if package_mgr not in ('yum', 'dnf'):
         module.fail_json(msg="package_mgr must be one of: yum, dnf")
-    pkg_mgr_exception = dict(yum=YUM_IMPORT_EXCEPTION, dnf=DNF_IMPORT_EXCEPTION)[package_mgr]
-    if pkg_mgr_exception:
-        module.fail_json(
-            msg="aos_version module could not import {}: {}".format(package_mgr, pkg_mgr_exception)
-        )
 
     # determine the packages we will look for
     package_list = module.params['package_list']
     if not package_list:
         module.fail_json(msg="package_list must not be empty")
 
-    # generate set with only the names of expected packages
-    expected_pkg_names = [p["name"] for p in package_list]
-
     # gather packages that require a multi_minor_release check
     multi_minor_pkgs = [p for p in package_list if p["check_multi"]]
 
@@ -79,14 +196,37 @@ def main():
     # should look like a version string with possibly many segments e.g. "3.4.1"
     versioned_pkgs = [p for p in package_list if p["version"]]
 
+    # with nothing to check, there is no need to query the package manager at all
+    # (which is also why the package manager is not imported until it is needed).
+    # NOTE: the package_version check always requests versions of docker and
+    # openvswitch, so it never hits this; it is a guard for other callers only.
+    if not versioned_pkgs and not multi_minor_pkgs:
+        module.exit_json(changed=False, msg="no version checks needed")
+
+    # generate set with only the names of expected packages
+    expected_pkg_names = frozenset(p["name"] for p in package_list)
+
     # get the list of packages available and complain if anything is wrong
     try:
-        pkgs = _retrieve_available_packages(package_mgr, expected_pkg_names)
+        pkgs = _load_cache(package_mgr, expected_pkg_names)
+        if pkgs is None:
+            pkgs = _retrieve_available_packages(
+                package_mgr, expected_pkg_names, use_yum_api=module.params['use_yum_api'],
+            )
+            _save_cache(package_mgr, expected_pkg_names, pkgs)
+        versioned_pkgs_dict = _to_dict(versioned_pkgs)
+        precise_found, higher_by_name, multi_found = _scan_all(
+            pkgs, versioned_pkgs_dict, _to_dict(multi_minor_pkgs),
+        )
         if versioned_pkgs:
-            _check_precise_version_found(pkgs, _to_dict(versioned_pkgs))
-            _check_higher_version_found(pkgs, _to_dict(versioned_pkgs))
+            _check_precise_version_found(precise_found, versioned_pkgs_dict)
+            _check_higher_version_found(higher_by_name)
+        # NOTE: even when the release requested is precise to the minor
+        # release, the multi-minor check is not implied by the checks above:
+        # those only flag versions higher than requested, while this also
+        # flags lower minor releases being available at the same time.
         if multi_minor_pkgs:
-            _check_multi_minor_release(pkgs, _to_dict(multi_minor_pkgs))
+            _check_multi_minor_release(multi_found)
     except AosVersionException as excinfo:
         module.fail_json(msg=str(excinfo))
     module.exit_json(changed=False)
@@ -96,7 +236,7 @@ def _to_dict(pkg_list):
     return {pkg["name"]: pkg for pkg in pkg_list}
 
 
-def _retrieve_available_packages(pkg_mgr, expected_pkgs):
+def _retrieve_available_packages(pkg_mgr, expected_pkgs, use_yum_api=False):
     # The openshift excluder prevents unintended updates to openshift
     # packages by setting yum excludes on those packages. See:
     # https://wiki.centos.org/SpecialInterestGroup/PaaS/OpenShift-Origin-Control-Updates
@@ -107,74 +247,398 @@ def _retrieve_available_packages(pkg_mgr, expected_pkgs):
     # what will really be available during an install or upgrade.
 
     if pkg_mgr == "yum":
-        # search for package versions available for openshift pkgs
-        yb = yum.YumBase()  # pylint: disable=invalid-name
+        # loading the whole yum API is much more work than we need in order
+        # to know the versions of a handful of packages; prefer repoquery
+        # unless asked otherwise or it is not available.
+        pkgs = None if use_yum_api else _retrieve_repoquery_packages(expected_pkgs)
+        if pkgs is None:
+            _check_import("yum", YUM_IMPORT_EXCEPTION)
+            # search for package versions available for openshift pkgs.
+            # Refreshing repo metadata is by far the most expensive part of
+            # this module, so first try with whatever metadata is already
+            # cached, and only refresh if there is no usable cache.
+            try:
+                pkgs = _retrieve_yum_packages(_yum_base(cache_only=True), expected_pkgs)
+            except yum.Errors.RepoError:
+                pkgs = _retrieve_yum_packages(_yum_base(cache_only=False), expected_pkgs)
+    elif pkg_mgr == "dnf":
+        _check_import("dnf", DNF_IMPORT_EXCEPTION)
+        # same as with yum, try cached metadata before refreshing it.
+        try:
+            pkgs = _retrieve_dnf_packages(_dnf_base(cache_only=True), expected_pkgs)
+        except dnf.exceptions.RepoError:
+            pkgs = _retrieve_dnf_packages(_dnf_base(cache_only=False), expected_pkgs)
 
-        yb.conf.disable_excludes = ['all']
+    if not pkgs:
+        # pkgs list is empty, raise because no expected packages found
+        raise AosVersionException('\n'.join([
+            'Unable to find any OpenShift packages.',
+            'Check your subscription and repo settings.',
+        ]))
 
-        try:
-            pkgs = yb.rpmdb.returnPackages(patterns=expected_pkgs)
-            pkgs += yb.pkgSack.returnPackages(patterns=expected_pkgs)
-        except yum.Errors.PackageSackError as excinfo:
-            # you only hit this if *none* of the packages are available
-            raise AosVersionException('\n'.join([
-                'Unable to find any OpenShift packages.',
-                'Check your subscription and repo settings.',
-                str(excinfo),
-            ]))
-    elif pkg_mgr == "dnf":
-        dbase = dnf.Base()  # pyling: disable=invalid-name
+    return pkgs
 
-        dbase.conf.disable_excludes = ['all']
-        dbase.read_all_repos()
-        dbase.fill_sack(load_system_repo=False, load_available_repos=True)
 
-        dquery = dbase.sack.query()
-        aquery = dquery.available()
-        iquery = dquery.installed()
+def _check_import(pkg_mgr, import_exception):
+    if import_exception:
+        raise AosVersionException(
+            "aos_version module could not import {}: {}".format(pkg_mgr, import_exception)
+        )
 
-        available_pkgs = list(aquery.filter(name=expected_pkgs))
-        installed_pkgs = list(iquery.filter(name=expected_pkgs))
-        pkgs = available_pkgs + installed_pkgs
 
-        if not pkgs:
-            # pkgs list is empty, raise because no expected packages found
-            raise AosVersionException('\n'.join([
-                'Unable to find any OpenShift packages.',
-                'Check your subscription and repo settings.',
-            ]))
+def _retrieve_repoquery_packages(expected_pkgs):
+    """Query installed and available versions of the expected packages with
+    repoquery. Returns a list of Package, or None if repoquery could not be
+    used and the caller should fall back to the yum API."""
+    # yum's repoquery has no --disableexcludes; as in lib_utils' Repoquery,
+    # point it at a copy of yum.conf with the exclude= line cleared instead.
+    with tempfile.NamedTemporaryFile(mode='w') as tmp_config:
+        try:
+            with open(YUM_CONF) as yum_conf:
+                tmp_config.writelines(
+                    "exclude=\n" if line.split("=", 1)[0].strip() == "exclude" else line
+                    for line in yum_conf
+                )
+            tmp_config.flush()
+        except (IOError, OSError):
+            return None
+
+        return _run_repoquery(expected_pkgs, tmp_config.name)
+
+
+def _run_repoquery(expected_pkgs, config):
+    # as with the yum API, try cached metadata before refreshing it
+    for cache_opts in (['--cache'], []):
+        # unlike the yum API, repoquery disables plugins unless asked, and
+        # plugins may provide repos (e.g. rhnplugin for Satellite channels)
+        cmd = ['repoquery', '--plugins', '--config=' + config, '--pkgnarrow=all', '--show-duplicates']
+        cmd += cache_opts
+        cmd += ['--queryformat', '%{name}\t%{version}']
+        cmd += list(expected_pkgs)
+        try:
+            output = subprocess.check_output(cmd)
+        except (OSError, subprocess.CalledProcessError):
+            # repoquery not installed, or could not work with the repos
+            return None
+
+        # repoquery matches its arguments as patterns; keep exact matches only
+        pkgs = [
+            pkg for pkg in (
+                Package(*line.split('\t'))
+                for line in output.decode('utf-8').splitlines()
+                if line.count('\t') == 1
+            )
+            if pkg.name in expected_pkgs
+        ]
+        if set(pkg.name for pkg in pkgs) == set(expected_pkgs):
+            return pkgs
+
+    # not everything found even with refreshed metadata; let the yum API
+    # have the final word on what is (not) available
+    return None
+
+
+def _yum_base(cache_only):
+    yb = yum.YumBase()  # pylint: disable=invalid-name
+
+    yb.conf.disable_excludes = ['all']
+    # only the primary metadata is needed to know package names and versions;
+    # avoid downloading filelists and other metadata.
+    yb.conf.mdpolicy = 'group:primary'
+    if cache_only:
+        yb.conf.cache = 1
+    for repo in yb.repos.listEnabled():
+        repo.mdpolicy = 'group:primary'
+        if cache_only:
+            repo.metadata_expire = -1
+            # a repo without usable cache must raise RepoError so we refresh,
+            # rather than be silently skipped
+            repo.skip_if_unavailable = False
+
+    return yb
+
+
+def _retrieve_yum_packages(yb, expected_pkgs):  # pylint: disable=invalid-name
+    # look up each package by exact name, which is an indexed lookup in the
+    # sqlite metadata, rather than matching patterns against every package.
+    pkgs = []
+    for name in expected_pkgs:
+        pkgs += yb.rpmdb.searchNevra(name=name)
+        pkgs += yb.pkgSack.searchNevra(name=name)
 
     return pkgs
 
 
+def _dnf_base(cache_only):
+    dbase = dnf.Base()
+
+    dbase.conf.disable_excludes = ['all']
+    dbase.conf.cacheonly = cache_only
+    dbase.read_all_repos()
+    if cache_only:
+        # a repo without usable cache must raise RepoError so we refresh,
+        # rather than be silently disabled by fill_sack
+        for repo in dbase.repos.iter_enabled():
+            repo.skip_if_unavailable = False
+    dbase.fill_sack(load_system_repo=False, load_available_repos=True)
+
+    return dbase
+
+
+def _retrieve_dnf_packages(dbase, expected_pkgs):
+    dquery = dbase.sack.query()
+    aquery = dquery.available()
+    iquery = dquery.installed()
+
+    available_pkgs = list(aquery.filter(name=list(expected_pkgs)))
+    installed_pkgs = list(iquery.filter(name=list(expected_pkgs)))
+
+    return available_pkgs + installed_pkgs
+
+
+def _cache_key(pkg_mgr, expected_pkgs):
+    mtimes = []
+    for pattern in CACHE_KEY_PATHS[pkg_mgr] + CACHE_KEY_PATHS_COMMON:
+        for path in sorted(glob.glob(pattern)):
+            try:
+                mtimes.append([path, os.stat(path).st_mtime])
+            except OSError:
+                continue
+    return [pkg_mgr, sorted(expected_pkgs), mtimes]
+
+
+def _load_cache(pkg_mgr, expected_pkgs):
+    """Return the list of Package cached by a previous run, or None if
+    there is no cached result for the current state of the host."""
+    try:
+        # only trust a cache file that we wrote ourselves
+        stat = os.stat(CACHE_FILE)
+        if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+            return None
+        with open(CACHE_FILE) as cache_file:
+            cache = json.load(cache_file)
+        if cache["key"] != _cache_key(pkg_mgr, expected_pkgs):
+            return None
+        return [Package(name, version) for name, version in cache["pkgs"]]
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        # missing, truncated or otherwise unusable cache
+        return None
+
+
+def _save_cache(pkg_mgr, expected_pkgs, pkgs):
+    cache = dict(
+        key=_cache_key(pkg_mgr, expected_pkgs),
+        pkgs=[[pkg.name, pkg.version] for pkg in pkgs],
+    )
+    try:
+        # write to a private file first and move it into place, so a reader
+        # never sees a partial file and we never follow someone else's link
+        cache_fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(CACHE_FILE))
+    except (IOError, OSError):
+        # caching is only an optimization, never fail the check over it
+        return
+    try:
+        with os.fdopen(cache_fd, 'w') as cache_file:
+            json.dump(cache, cache_file)
+        os.rename(tmp_path, CACHE_FILE)
+    except (IOError, OSError, TypeError, ValueError):
+        # don't leave partial files behind either
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+
+def _parse_pkgs(pkgs, layout):
+    """Reduce package objects to a dict of {name: {packed version: version}},
+    so versions are parsed only once per package and the checks can work on
+    all versions of a package at once. Duplicate versions (e.g. installed and
+    available) are kept only once.
+
+    Versions are packed to a layout of (segments, bits) wide enough for all of
+    them and at least as wide as the layout given. Returns the dict and that
+    layout, which versions to compare with the packed ones must be packed to."""
+    # NOTE: packages are retrieved by exact name, so all are expected ones.
+    # This is not worth splitting across processes even for long package
+    # lists: versions repeat, so nearly every package is one dict lookup,
+    # far less than it would cost to fork workers and pickle the packages.
+    segments, bits = layout
+    version_strs_for_pkg = {}
+    for pkg in pkgs:
+        version_strs = version_strs_for_pkg.get(pkg.name)
+        if version_strs is None:
+            version_strs = version_strs_for_pkg[pkg.name] = set()
+        if pkg.version not in version_strs:
+            version_strs.add(pkg.version)
+            parsed, needed_bits = _parse_version(pkg.version)
+            segments = max(segments, len(parsed))
+            bits = max(bits, needed_bits)
+
+    # only now is the layout known; pack the (few) distinct versions to it
+    layout = (segments, bits)
+    versions_for_pkg = {}
+    for name, version_strs in version_strs_for_pkg.items():
+        versions_for_pkg[name] = dict(
+            (_pack_version(version, layout), version) for version in version_strs
+        )
+    return versions_for_pkg, layout
+
+
+def _scan_all(pkgs, expected_pkgs_dict, multi_minor_pkgs_dict):
+    """Scan the packages once for everything the version checks need.
+    Returns a set of names of packages found at a requested version, a dict
+    of the highest version string found for packages available at a version
+    higher than requested, and a list of names of packages needing the multi-minor
+    check that are available in more than one minor release."""
+
+    # the requested versions must fit the packed layout too
+    req_versions_for_pkg = {}
+    layout = _DEFAULT_LAYOUT
+    for name, pkg in expected_pkgs_dict.items():
+        expected_pkg_versions = pkg["version"]
+        if isinstance(expected_pkg_versions, string_types):
+            expected_pkg_versions = [expected_pkg_versions]
+        req_versions_for_pkg[name] = expected_pkg_versions
+        for version in expected_pkg_versions:
+            layout = _fit_layout(layout, version)
+
+    parsed_pkgs, layout = _parse_pkgs(pkgs, layout)
+    segments, bits = layout
+    minor_release_shift = bits * (segments - 2)
+
+    # parse the requested versions once, not once per package
+    for name, versions in req_versions_for_pkg.items():
+        req_versions_for_pkg[name] = [_requested_version(version, layout) for version in versions]
+
+    precise_found = set()
+    higher_by_name = {}
+    multi_found = []
+    for name, versions in parsed_pkgs.items():
+        if name in multi_minor_pkgs_dict:
+            # keep track of x.y (minor release) versions seen, until a second one turns up
+            minor_releases = set()
+            for version in versions:
+                minor_releases.add(version >> minor_release_shift)
+                if len(minor_releases) > 1:
+                    multi_found.append(name)
+                    break
+
+        if name not in req_versions_for_pkg:
+            continue
+        req_versions = req_versions_for_pkg[name]
+
+        # does any version match, to the precision requested?
+        if any(
+                _compare_versions(version, req_version) == 0
+                for req_version in req_versions
+                for version in versions
+        ):
+            precise_found.add(name)
+
+        # is any strictly greater, at the precision requested?
+        # if any version is, the highest one is, so that is all we compare.
+        # NOTE: the list of versions is assumed to be sorted so that the highest
+        # desirable version is the last.
+        version = max(versions)
+        if _compare_versions(version, req_versions[-1]) > 0:
+            higher_by_name[name] = versions[version]
+
+    return precise_found, higher_by_name, multi_found
+
+
+# Versions are compared as integers packing each segment, plus one, into a
+# fixed number of bits, padded with zeros (meaning "no segment") to a fixed
+# number of segments; e.g. "3.7.1" is 0x0004000800020000 with the default
+# layout of 4 segments of 16 bits. So like comparing lists of segments,
+# "3.7" < "3.7.0" < "3.7.1". The layout is widened to fit all the versions
+# compared with each other, which must all be packed to the same layout.
+_DEFAULT_LAYOUT = (4, 16)
+
+# parsed segments and the bits needed to pack them, by version string.
+# Repos carry many builds of only a few distinct versions (master and node
+# are built together, for instance), so most lookups hit. The module runs
+# once per host, so no need to bound it.
+_PARSED_VERSIONS = {}
+
+
+def _parse_version(version):
+    """Return the segments of a version string like "3.7.1" as a tuple of
+    ints, and the number of bits needed to pack each of them."""
+    parsed = _PARSED_VERSIONS.get(version)
+    if parsed is None:
+        # walk the segments in place rather than splitting the string
+        segments = []
+        start = 0
+        while True:
+            end = version.find(".", start)
+            segments.append(int(version[start:end] if end >= 0 else version[start:]))
+            if end < 0:
+                break
+            start = end + 1
+        parsed = _PARSED_VERSIONS[version] = (tuple(segments), (max(segments) + 1).bit_length())
+    return parsed
+
+
+def _fit_layout(layout, version):
+    """Return the layout widened as needed to also fit the given version."""
+    parsed, bits = _parse_version(version)
+    return max(layout[0], len(parsed)), max(layout[1], bits)
+
+
+def _pack_version(version, layout=None):
+    """Pack a version string into an integer that compares the same way as
+    the version does, with the given (segments, bits) layout. Defaults to the
+    default layout widened to fit the version."""
+    if layout is None:
+        layout = _fit_layout(_DEFAULT_LAYOUT, version)
+    segments, bits = layout
+    parsed, _ = _parse_version(version)
+    packed = 0
+    for segment in parsed:
+        packed = (packed << bits) | (segment + 1)
+    return packed << bits * (segments - len(parsed))
+
+
+def _requested_version(version, layout):
+    """Parse a requested version string for use with _compare_versions,
+    against versions packed to the given layout. Returns the shift that
+    discards the segments of a packed version beyond the precision
+    requested, and the requested version so shifted."""
+    segments, bits = layout
+    shift = bits * (segments - len(_parse_version(version)[0]))
+    return shift, _pack_version(version, layout) >> shift
+
+
+def _compare_versions(version, requested_version):
+    """Compare a packed version with a requested version, at the precision
+    requested. Returns -1, 0 or 1 as the version is lower than, matches or
+    is higher than requested; so e.g. 3.4.1.5 matches 3.4.1 and 3.5 is
+    higher than 3.4.1."""
+    shift, requested = requested_version
+    version >>= shift
+    return (version > requested) - (version < requested)
+
+
 class PreciseVersionNotFound(AosVersionException):
     """Exception for reporting packages not available at given version"""
+    template = '\n'.join([
+        'Not all of the required packages are available at their requested version',
+        '{}',
+        'Please check your subscriptions and enabled repositories.',
+    ])
+
     def __init__(self, not_found):
-        msg = ['Not all of the required packages are available at their requested version']
-        msg += ['{}:{} '.format(pkg["name"], pkg["version"]) for pkg in not_found]
-        msg += ['Please check your subscriptions and enabled repositories.']
-        AosVersionException.__init__(self, '\n'.join(msg), not_found)
+        msg = self.template.format('\n'.join(
+            ['{}:{} '.format(pkg["name"], pkg["version"]) for pkg in not_found]
+        ))
+        AosVersionException.__init__(self, msg, not_found)
 
 
-def _check_precise_version_found(pkgs, expected_pkgs_dict):
+def _check_precise_version_found(pkgs_precise_version_found, expected_pkgs_dict):
     # see if any packages couldn't be found at requested release version
     # we would like to verify that the latest available pkgs have however specific a version is given.
     # so e.g. if there is a package version 3.4.1.5 the check passes; if only 3.4.0, it fails.
 
-    pkgs_precise_version_found = set()
-    for pkg in pkgs:
-        if pkg.name not in expected_pkgs_dict:
-            continue
-        expected_pkg_versions = expected_pkgs_dict[pkg.name]["version"]
-        if isinstance(expected_pkg_versions, string_types):
-            expected_pkg_versions = [expected_pkg_versions]
-        for expected_pkg_version in expected_pkg_versions:
-            # does the version match, to the precision requested?
-            # and, is it strictly greater, at the precision requested?
-            match_version = '.'.join(pkg.version.split('.')[:expected_pkg_version.count('.') + 1])
-            if match_version == expected_pkg_version:
-                pkgs_precise_version_found.add(pkg.name)
-
     not_found = []
     for name, pkg in expected_pkgs_dict.items():
         if name not in pkgs_precise_version_found:
@@ -186,67 +650,41 @@ def _check_precise_version_found(pkgs, expected_pkgs_dict):
 
 class FoundHigherVersion(AosVersionException):
     """Exception for reporting that a higher version than requested is available"""
-    def __init__(self, higher_found):
-        msg = ['Some required package(s) are available at a version',
-               'that is higher than requested']
-        msg += ['  ' + name for name in higher_found]
-        msg += ['This will prevent installing the version you requested.']
-        msg += ['Please check your enabled repositories or adjust openshift_release.']
-        AosVersionException.__init__(self, '\n'.join(msg), higher_found)
+    template = '\n'.join([
+        'Some required package(s) are available at a version',
+        'that is higher than requested',
+        '{}',
+        'This will prevent installing the version you requested.',
+        'Please check your enabled repositories or adjust openshift_release.',
+    ])
 
+    def __init__(self, higher_found):
+        msg = self.template.format('\n'.join(['  ' + name for name in higher_found]))
+        AosVersionException.__init__(self, msg, higher_found)
 
-def _check_higher_version_found(pkgs, expected_pkgs_dict):
-    expected_pkg_names = list(expected_pkgs_dict)
 
+def _check_higher_version_found(higher_version_for_pkg):
     # see if any packages are available in a version higher than requested
-    higher_version_for_pkg = {}
-    for pkg in pkgs:
-        if pkg.name not in expected_pkg_names:
-            continue
-        expected_pkg_versions = expected_pkgs_dict[pkg.name]["version"]
-        if isinstance(expected_pkg_versions, string_types):
-            expected_pkg_versions = [expected_pkg_versions]
-        # NOTE: the list of versions is assumed to be sorted so that the highest
-        # desirable version is the last.
-        highest_desirable_version = expected_pkg_versions[-1]
-        req_release_arr = [int(segment) for segment in highest_desirable_version.split(".")]
-        version = [int(segment) for segment in pkg.version.split(".")]
-        too_high = version[:len(req_release_arr)] > req_release_arr
-        higher_than_seen = version > higher_version_for_pkg.get(pkg.name, [])
-        if too_high and higher_than_seen:
-            higher_version_for_pkg[pkg.name] = version
-
     if higher_version_for_pkg:
-        higher_found = []
-        for name, version in higher_version_for_pkg.items():
-            higher_found.append(name + '-' + '.'.join(str(segment) for segment in version))
+        higher_found = [name + '-' + version for name, version in higher_version_for_pkg.items()]
         raise FoundHigherVersion(higher_found)
 
 
 class FoundMultiRelease(AosVersionException):
     """Exception for reporting multiple minor releases found for same package"""
+    template = '\n'.join([
+        'Multiple minor versions of these packages are available',
+        '{}',
+        'There should only be one OpenShift release repository enabled at a time.',
+    ])
+
     def __init__(self, multi_found):
-        msg = ['Multiple minor versions of these packages are available']
-        msg += ['  ' + name for name in multi_found]
-        msg += ["There should only be one OpenShift release repository enabled at a time."]
-        AosVersionException.__init__(self, '\n'.join(msg), multi_found)
+        msg = self.template.format('\n'.join(['  ' + name for name in multi_found]))
+        AosVersionException.__init__(self, msg, multi_found)
 
 
-def _check_multi_minor_release(pkgs, expected_pkgs_dict):
+def _check_multi_minor_release(multi_found):
     # see if any packages are available in more than one minor version
-    pkgs_by_name_version = {}
-    for pkg in pkgs:
-        # keep track of x.y (minor release) versions seen
-        minor_release = '.'.join(pkg.version.split('.')[:2])
-        if pkg.name not in pkgs_by_name_version:
-            pkgs_by_name_version[pkg.name] = set()
-        pkgs_by_name_version[pkg.name].add(minor_release)
-
-    multi_found = []
-    for name in expected_pkgs_dict:
-        if name in pkgs_by_name_version and len(pkgs_by_name_version[name]) > 1:
-            multi_found.append(name)
-
     if multi_found:
         raise FoundMultiRelease(multi_found)
 
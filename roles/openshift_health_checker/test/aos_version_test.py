@@ -1,3 +1,6 @@
+import io
+import json
+
 import pytest
 import aos_version
 
@@ -18,6 +21,10 @@ expected_pkgs = {
 }
 
 
+def _scan_all(pkgs, expected_pkgs_dict, multi_minor_pkgs_dict=None):
+    return aos_version._scan_all(pkgs, expected_pkgs_dict, multi_minor_pkgs_dict or {})
+
+
 @pytest.mark.parametrize('pkgs,expected_pkgs_dict', [
     (
         # all found
@@ -51,7 +58,8 @@ expected_pkgs = {
     ),
 ])
 def test_check_precise_version_found(pkgs, expected_pkgs_dict):
-    aos_version._check_precise_version_found(pkgs, expected_pkgs_dict)
+    precise_found, _, _ = _scan_all(pkgs, expected_pkgs_dict)
+    aos_version._check_precise_version_found(precise_found, expected_pkgs_dict)
 
 
 @pytest.mark.parametrize('pkgs,expect_not_found', [
@@ -102,11 +110,43 @@ def test_check_precise_version_found(pkgs, expected_pkgs_dict):
     ),
 ])
 def test_check_precise_version_found_fail(pkgs, expect_not_found):
+    precise_found, _, _ = _scan_all(pkgs, expected_pkgs)
     with pytest.raises(aos_version.PreciseVersionNotFound) as e:
-        aos_version._check_precise_version_found(pkgs, expected_pkgs)
+        aos_version._check_precise_version_found(precise_found, expected_pkgs)
     assert list(expect_not_found.values()) == e.value.problem_pkgs
 
 
+def test_check_precise_version_found_fail_all_segments():
+    # enterprise versions have five segments, and all of them matter
+    expected_pkgs_dict = {
+        "atomic-openshift": {
+            "name": "atomic-openshift",
+            "version": "3.6.173.0.5",
+            "check_multi": False,
+        },
+    }
+    precise_found, _, _ = _scan_all([Package('atomic-openshift', '3.6.173.0.21')], expected_pkgs_dict)
+    with pytest.raises(aos_version.PreciseVersionNotFound):
+        aos_version._check_precise_version_found(precise_found, expected_pkgs_dict)
+
+
+@pytest.mark.parametrize('available,requested', [
+    ('3.7', '3.7.0'),
+    ('3.7.0.65536', '3.7.0.70000'),
+])
+def test_check_precise_version_found_fail_shorter_or_larger(available, requested):
+    expected_pkgs_dict = {
+        "spam": {
+            "name": "spam",
+            "version": requested,
+            "check_multi": False,
+        },
+    }
+    precise_found, _, _ = _scan_all([Package('spam', available)], expected_pkgs_dict)
+    with pytest.raises(aos_version.PreciseVersionNotFound):
+        aos_version._check_precise_version_found(precise_found, expected_pkgs_dict)
+
+
 @pytest.mark.parametrize('pkgs,expected_pkgs_dict', [
     (
         [],
@@ -129,7 +169,8 @@ def test_check_precise_version_found_fail(pkgs, expect_not_found):
     ),
 ])
 def test_check_higher_version_found(pkgs, expected_pkgs_dict):
-    aos_version._check_higher_version_found(pkgs, expected_pkgs_dict)
+    _, higher_by_name, _ = _scan_all(pkgs, expected_pkgs_dict)
+    aos_version._check_higher_version_found(higher_by_name)
 
 
 @pytest.mark.parametrize('pkgs,expected_pkgs_dict,expect_higher', [
@@ -153,6 +194,22 @@ def test_check_higher_version_found(pkgs, expected_pkgs_dict):
         expected_pkgs,
         ['eggs-3.4'],  # multiple versions, two are higher
     ),
+    (
+        [Package('spam', '3.6.173.0.21')],
+        {
+            "spam": {
+                "name": "spam",
+                "version": "3.6.173.0.5",
+                "check_multi": False,
+            }
+        },
+        ['spam-3.6.173.0.21'],  # higher only in the fifth segment
+    ),
+    (
+        [Package('spam', '3.7.1.0.21'), Package('spam', '3.7.1.0.5')],
+        expected_pkgs,
+        ['spam-3.7.1.0.21'],  # versions differing past the fourth segment are kept apart
+    ),
     (
         [Package('ovs', '2.8')],
         {
@@ -166,8 +223,9 @@ def test_check_higher_version_found(pkgs, expected_pkgs_dict):
     ),
 ])
 def test_check_higher_version_found_fail(pkgs, expected_pkgs_dict, expect_higher):
+    _, higher_by_name, _ = _scan_all(pkgs, expected_pkgs_dict)
     with pytest.raises(aos_version.FoundHigherVersion) as e:
-        aos_version._check_higher_version_found(pkgs, expected_pkgs_dict)
+        aos_version._check_higher_version_found(higher_by_name)
     assert set(expect_higher) == set(e.value.problem_pkgs)
 
 
@@ -177,7 +235,8 @@ def test_check_higher_version_found_fail(pkgs, expected_pkgs_dict, expect_higher
     [Package('spam', '3.2.1'), Package('eggs', '3.2.2')],
 ])
 def test_check_multi_minor_release(pkgs):
-    aos_version._check_multi_minor_release(pkgs, expected_pkgs)
+    _, _, multi_found = _scan_all(pkgs, {}, expected_pkgs)
+    aos_version._check_multi_minor_release(multi_found)
 
 
 @pytest.mark.parametrize('pkgs,expect_to_flag_pkgs', [
@@ -191,6 +250,403 @@ def test_check_multi_minor_release(pkgs):
     ),
 ])
 def test_check_multi_minor_release_fail(pkgs, expect_to_flag_pkgs):
+    _, _, multi_found = _scan_all(pkgs, {}, expected_pkgs)
     with pytest.raises(aos_version.FoundMultiRelease) as e:
-        aos_version._check_multi_minor_release(pkgs, expected_pkgs)
+        aos_version._check_multi_minor_release(multi_found)
     assert set(expect_to_flag_pkgs) == set(e.value.problem_pkgs)
+
+
+@pytest.fixture
+def yum_conf(monkeypatch, tmpdir):
+    conf = tmpdir.join('yum.conf')
+    conf.write('[main]\nexclude= atomic-openshift* docker*\ngpgcheck=1\n')
+    monkeypatch.setattr(aos_version, 'YUM_CONF', str(conf))
+    return conf
+
+
+@pytest.mark.parametrize('outputs,expect_pkgs', [
+    (
+        [b'spam\t3.2.1\neggs\t3.2.1\nspam-utils\t3.2.1\n'],
+        [Package('spam', '3.2.1'), Package('eggs', '3.2.1')],
+    ),
+    (
+        # nothing in the cache, so the query is repeated with refreshed metadata
+        [b'', b'spam\t3.2.1\neggs\t3.2.2\n'],
+        [Package('spam', '3.2.1'), Package('eggs', '3.2.2')],
+    ),
+    (
+        # only some packages found, so let the yum API report what is missing
+        [b'spam\t3.2.1\n', b'spam\t3.2.1\n'],
+        None,
+    ),
+    (
+        # nothing found at all, let the yum API report it
+        [b'', b''],
+        None,
+    ),
+])
+def test_retrieve_repoquery_packages(monkeypatch, yum_conf, outputs, expect_pkgs):
+    outputs = list(outputs)
+    monkeypatch.setattr(aos_version.subprocess, 'check_output', lambda *_, **__: outputs.pop(0))
+    assert aos_version._retrieve_repoquery_packages(['spam', 'eggs']) == expect_pkgs
+
+
+def test_retrieve_repoquery_packages_command(monkeypatch, yum_conf):
+    calls = []
+
+    def check_output(cmd, **kwargs):
+        config = [arg for arg in cmd if arg.startswith('--config=')]
+        with open(config[0][len('--config='):]) as config_file:
+            calls.append((cmd, kwargs, config_file.read()))
+        return b'spam\t3.2.1\n'
+    monkeypatch.setattr(aos_version.subprocess, 'check_output', check_output)
+
+    aos_version._retrieve_repoquery_packages(['spam'])
+    cmd, kwargs, config = calls[0]
+    # plugins may provide repos, and warnings must not mix with the output
+    assert '--plugins' in cmd
+    assert 'stderr' not in kwargs
+    # yum's repoquery has no --disableexcludes; excludes are cleared in a copy of yum.conf
+    assert not any(arg.startswith('--disableexcludes') for arg in cmd)
+    assert config == '[main]\nexclude=\ngpgcheck=1\n'
+
+
+def test_retrieve_repoquery_packages_no_yum_conf(monkeypatch, tmpdir):
+    monkeypatch.setattr(aos_version, 'YUM_CONF', str(tmpdir.join('missing.conf')))
+    monkeypatch.setattr(aos_version.subprocess, 'check_output', lambda *_, **__: pytest.fail('should not run'))
+    assert aos_version._retrieve_repoquery_packages(['spam']) is None
+
+
+def test_retrieve_repoquery_packages_not_installed(monkeypatch, yum_conf):
+    def check_output(*_, **__):
+        raise OSError('No such file or directory')
+    monkeypatch.setattr(aos_version.subprocess, 'check_output', check_output)
+    assert aos_version._retrieve_repoquery_packages(['spam', 'eggs']) is None
+
+
+def test_cache_roundtrip(monkeypatch, tmpdir):
+    repomd = tmpdir.join('repomd.xml')
+    repomd.write('')
+    monkeypatch.setattr(aos_version, 'CACHE_FILE', str(tmpdir.join('cache.json')))
+    monkeypatch.setattr(aos_version, 'CACHE_KEY_PATHS', dict(yum=[str(repomd)]))
+    monkeypatch.setattr(aos_version, 'CACHE_KEY_PATHS_COMMON', [])
+
+    pkgs = [Package('spam', '3.2.1'), Package('eggs', '3.2.1')]
+    assert aos_version._load_cache('yum', ['spam', 'eggs']) is None
+    aos_version._save_cache('yum', ['spam', 'eggs'], pkgs)
+    assert aos_version._load_cache('yum', ['eggs', 'spam']) == pkgs
+
+    # asking for different packages misses the cache
+    assert aos_version._load_cache('yum', ['spam']) is None
+
+    # repo metadata changes invalidate the cache
+    repomd.setmtime(repomd.mtime() + 10)
+    assert aos_version._load_cache('yum', ['spam', 'eggs']) is None
+
+
+def test_save_cache_failure_cleans_up(monkeypatch, tmpdir):
+    monkeypatch.setattr(aos_version, 'CACHE_FILE', str(tmpdir.join('cache.json')))
+    monkeypatch.setattr(aos_version, 'CACHE_KEY_PATHS', dict(yum=[]))
+    monkeypatch.setattr(aos_version, 'CACHE_KEY_PATHS_COMMON', [])
+
+    def fail_rename(*_):
+        raise OSError('spam')
+    monkeypatch.setattr(aos_version.os, 'rename', fail_rename)
+
+    aos_version._save_cache('yum', ['spam'], [Package('spam', '3.2.1')])
+    assert tmpdir.listdir() == []
+
+
+@pytest.mark.parametrize('pkgs', [
+    None,  # key matches but no packages entry
+    [['spam']],
+    [['spam', '3.2.1', 'extra']],
+    42,
+])
+def test_load_cache_unusable(monkeypatch, tmpdir, pkgs):
+    monkeypatch.setattr(aos_version, 'CACHE_FILE', str(tmpdir.join('cache.json')))
+    monkeypatch.setattr(aos_version, 'CACHE_KEY_PATHS', dict(yum=[]))
+    monkeypatch.setattr(aos_version, 'CACHE_KEY_PATHS_COMMON', [])
+
+    aos_version._save_cache('yum', ['spam'], [])
+    cache_file = tmpdir.join('cache.json')
+    cache = json.loads(cache_file.read())
+    if pkgs is None:
+        del cache['pkgs']
+    else:
+        cache['pkgs'] = pkgs
+    cache_file.write(json.dumps(cache))
+
+    assert aos_version._load_cache('yum', ['spam']) is None
+
+
+def test_parse_pkgs_keeps_distinct_versions():
+    pkgs = [Package('spam', '3.7.1.0.21'), Package('spam', '3.7.1.0.5'), Package('spam', '3.7.1.0.5')]
+    parsed_pkgs, layout = aos_version._parse_pkgs(pkgs, aos_version._DEFAULT_LAYOUT)
+    versions = parsed_pkgs['spam']
+    assert sorted(versions.values()) == ['3.7.1.0.21', '3.7.1.0.5']
+    assert versions[max(versions)] == '3.7.1.0.21'
+    # widened to fit the five segments
+    assert layout == (5, 16)
+
+
+@pytest.mark.parametrize('lower,higher', [
+    ('3.2', '3.3'),
+    ('3.2', '3.2.1'),
+    ('3.2.9', '3.10'),
+    ('3.2.1.5', '3.2.1.6'),
+    ('1.12.6', '1.13'),
+    ('3.6.173.0.5', '3.6.173.0.21'),
+    ('3.6.173.0.21', '3.6.173.1'),
+    ('3.6.173', '3.6.173.0.5'),
+    ('3.7', '3.7.0'),
+    ('3.7.0', '3.7.0.0'),
+    ('3.7.0.65536', '3.7.0.70000'),
+])
+def test_pack_version(lower, higher):
+    # versions compared with each other are packed to the same layout
+    layout = aos_version._fit_layout(aos_version._fit_layout((6, 16), lower), higher)
+    assert aos_version._pack_version(lower, layout) < aos_version._pack_version(higher, layout)
+
+
+def test_fast_module(monkeypatch, tmpdir, capsys):
+    args_file = tmpdir.join('args')
+    args_file.write('{"ANSIBLE_MODULE_ARGS": {"package_list": [], "package_mgr": "yum"}}')
+    monkeypatch.setattr(aos_version.sys, 'argv', ['aos_version', str(args_file)])
+
+    module = aos_version._FastModule(aos_version.ARGUMENT_SPEC)
+    assert module.params == dict(package_list=[], package_mgr="yum", use_yum_api=False)
+
+    with pytest.raises(SystemExit) as e:
+        module.fail_json(msg="spam")
+    assert e.value.code == 1
+    assert '"failed": true' in capsys.readouterr()[0]
+
+
+def test_fast_module_args_on_stdin(monkeypatch):
+    # this is how AnsiballZ passes the arguments to new-style modules
+    stdin = io.BytesIO(b'{"ANSIBLE_MODULE_ARGS": {"package_list": [], "package_mgr": "dnf"}}')
+    monkeypatch.setattr(aos_version.sys, 'argv', ['aos_version'])
+    monkeypatch.setattr(aos_version.sys, 'stdin', stdin)
+
+    module = aos_version._FastModule(aos_version.ARGUMENT_SPEC)
+    assert module.params == dict(package_list=[], package_mgr="dnf", use_yum_api=False)
+
+
+def test_fast_module_missing_required(monkeypatch, tmpdir):
+    args_file = tmpdir.join('args')
+    args_file.write('{"package_list": []}')
+    monkeypatch.setattr(aos_version.sys, 'argv', ['aos_version', str(args_file)])
+
+    with pytest.raises(SystemExit):
+        aos_version._FastModule(aos_version.ARGUMENT_SPEC)
+
+
+@pytest.mark.parametrize('use_yum_api,expected', [
+    (True, True),
+    ('yes', True),
+    ('True', True),
+    (1, True),
+    (False, False),
+    ('no', False),
+    ('false', False),
+    ('0', False),
+])
+def test_fast_module_converts_bool(monkeypatch, use_yum_api, expected):
+    args = dict(package_list=[], package_mgr="yum", use_yum_api=use_yum_api)
+    monkeypatch.setattr(aos_version.sys, 'argv', ['aos_version', json.dumps(args)])
+
+    module = aos_version._FastModule(aos_version.ARGUMENT_SPEC)
+    assert module.params['use_yum_api'] is expected
+
+
+def test_fast_module_converts_list(monkeypatch):
+    args = dict(package_list="spam,eggs", package_mgr="yum")
+    monkeypatch.setattr(aos_version.sys, 'argv', ['aos_version', json.dumps(args)])
+
+    module = aos_version._FastModule(aos_version.ARGUMENT_SPEC)
+    assert module.params['package_list'] == ['spam', 'eggs']
+
+
+@pytest.mark.parametrize('args', [
+    dict(package_list=[], package_mgr="yum", use_yum_api="maybe"),
+    dict(package_list=[], package_mgr="yum", use_yum_api=[]),
+    dict(package_list={}, package_mgr="yum"),
+])
+def test_fast_module_rejects_wrong_types(monkeypatch, capsys, args):
+    monkeypatch.setattr(aos_version.sys, 'argv', ['aos_version', json.dumps(args)])
+
+    with pytest.raises(SystemExit) as e:
+        aos_version._FastModule(aos_version.ARGUMENT_SPEC)
+    assert e.value.code == 1
+    assert 'unable to convert' in capsys.readouterr()[0]
+
+
+@pytest.mark.parametrize('version,requested,expected', [
+    ('3.4.1', '3.4.1', 0),
+    ('3.4.1.5', '3.4.1', 0),
+    ('3.4', '3.4.1', -1),
+    ('3.4.0', '3.4.1', -1),
+    ('3.5', '3.4.1', 1),
+    ('3.4.2', '3.4', 0),
+    ('3.6.173.0.5', '3.6.173.0.5', 0),
+    ('3.6.173.0.21', '3.6.173.0.5', 1),
+    ('3.6.173.0.5', '3.6.173.0.21', -1),
+    ('3.6.173.0.21', '3.6.173', 0),
+    ('3.6.173.0.21', '3.6.174', -1),
+    ('3.7', '3.7.0', -1),
+    ('3.7.0', '3.7', 0),
+    ('3.7.0.70000', '3.7.0.65536', 1),
+    ('3.7.0.65536', '3.7.0.70000', -1),
+])
+def test_compare_versions(version, requested, expected):
+    layout = aos_version._fit_layout(aos_version._fit_layout((5, 16), version), requested)
+    packed = aos_version._pack_version(version, layout)
+    requested_version = aos_version._requested_version(requested, layout)
+    assert aos_version._compare_versions(packed, requested_version) == expected
+
+
+def test_main_nothing_to_check(monkeypatch, tmpdir, capsys):
+    args_file = tmpdir.join('args')
+    args_file.write(
+        '{"package_mgr": "yum", "package_list": [{"name": "spam", "version": "", "check_multi": false}]}'
+    )
+    monkeypatch.setenv(aos_version.FAST_STARTUP_ENV, '1')
+    monkeypatch.setattr(aos_version.sys, 'argv', ['aos_version', str(args_file)])
+    # the package manager is not even needed
+    monkeypatch.setattr(aos_version, 'YUM_IMPORT_EXCEPTION', ImportError('No module named yum'))
+
+    with pytest.raises(SystemExit) as e:
+        aos_version.main()
+    assert e.value.code == 0
+    assert 'failed' not in capsys.readouterr()[0]
+
+
+def test_retrieve_available_packages_without_yum(monkeypatch):
+    # repoquery does not need the yum Python module
+    monkeypatch.setattr(aos_version, 'YUM_IMPORT_EXCEPTION', ImportError('No module named yum'))
+    monkeypatch.setattr(aos_version, '_retrieve_repoquery_packages', lambda _: [Package('spam', '3.2.1')])
+    assert aos_version._retrieve_available_packages('yum', ['spam']) == [Package('spam', '3.2.1')]
+
+    # but the fallback to the yum API does
+    monkeypatch.setattr(aos_version, '_retrieve_repoquery_packages', lambda _: None)
+    with pytest.raises(aos_version.AosVersionException) as e:
+        aos_version._retrieve_available_packages('yum', ['spam'])
+    assert 'could not import yum' in str(e.value)
+
+
+class RepoError(Exception):
+    pass
+
+
+class FakeRepo(object):
+    metadata_expire = None
+    skip_if_unavailable = None
+
+
+class FakeConf(object):
+    cache = 0
+    cacheonly = False
+
+
+class FakeYumBase(object):
+    """Stands in for yum.YumBase, without usable cached metadata."""
+    instances = []
+
+    def __init__(self):
+        self.conf = FakeConf()
+        self.repo = FakeRepo()
+        self.repos = self
+        self.rpmdb = self
+        self.instances.append(self)
+
+    def listEnabled(self):  # pylint: disable=invalid-name
+        return [self.repo]
+
+    def searchNevra(self, name):  # pylint: disable=invalid-name
+        return [Package(name, '3.2.1')]
+
+    @property
+    def pkgSack(self):  # pylint: disable=invalid-name
+        # yum loads metadata lazily, and fails on first use without a cache
+        if self.conf.cache:
+            raise RepoError('Cannot find a valid baseurl for repo: spam')
+        return self
+
+
+class FakeDnfBase(object):
+    """Stands in for dnf.Base, without usable cached metadata."""
+    instances = []
+
+    def __init__(self):
+        self.conf = FakeConf()
+        self.repo = FakeRepo()
+        self.repos = self
+        self.instances.append(self)
+
+    def read_all_repos(self):
+        pass
+
+    def iter_enabled(self):
+        return [self.repo]
+
+    def fill_sack(self, **_):
+        if self.conf.cacheonly:
+            raise RepoError('Cache-only enabled but no cache for spam')
+        self.sack = self  # pylint: disable=attribute-defined-outside-init
+
+    def query(self):
+        return self
+
+    def available(self):
+        return self
+
+    def installed(self):
+        return self
+
+    def filter(self, name):
+        return [Package(pkg_name, '3.2.1') for pkg_name in name]
+
+
+class Namespace(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def test_retrieve_yum_packages_refreshes_without_cache(monkeypatch):
+    fake_yum = Namespace(YumBase=FakeYumBase, Errors=Namespace(RepoError=RepoError))
+    monkeypatch.setattr(aos_version, 'yum', fake_yum, raising=False)
+    monkeypatch.setattr(aos_version, 'YUM_IMPORT_EXCEPTION', None)
+    monkeypatch.setattr(FakeYumBase, 'instances', [])
+
+    pkgs = aos_version._retrieve_available_packages('yum', ['spam'], use_yum_api=True)
+    assert pkgs == [Package('spam', '3.2.1'), Package('spam', '3.2.1')]
+
+    cache_only, refreshed = FakeYumBase.instances
+    assert cache_only.conf.disable_excludes == refreshed.conf.disable_excludes == ['all']
+    assert cache_only.repo.mdpolicy == refreshed.repo.mdpolicy == 'group:primary'
+    assert cache_only.conf.cache == 1
+    assert cache_only.repo.metadata_expire == -1
+    assert cache_only.repo.skip_if_unavailable is False
+    # the refresh leaves the repo configuration alone
+    assert refreshed.conf.cache == 0
+    assert refreshed.repo.metadata_expire is None
+    assert refreshed.repo.skip_if_unavailable is None
+
+
+def test_retrieve_dnf_packages_refreshes_without_cache(monkeypatch):
+    fake_dnf = Namespace(Base=FakeDnfBase, exceptions=Namespace(RepoError=RepoError))
+    monkeypatch.setattr(aos_version, 'dnf', fake_dnf, raising=False)
+    monkeypatch.setattr(aos_version, 'DNF_IMPORT_EXCEPTION', None)
+    monkeypatch.setattr(FakeDnfBase, 'instances', [])
+
+    pkgs = aos_version._retrieve_available_packages('dnf', ['spam'])
+    assert pkgs == [Package('spam', '3.2.1'), Package('spam', '3.2.1')]
+
+    cache_only, refreshed = FakeDnfBase.instances
+    assert cache_only.conf.disable_excludes == refreshed.conf.disable_excludes == ['all']
+    assert cache_only.conf.cacheonly is True
+    assert cache_only.repo.skip_if_unavailable is False
+    # the refresh leaves the repo configuration alone
+    assert refreshed.conf.cacheonly is False
+    assert refreshed.repo.skip_if_unavailable is None